@@ -13,29 +13,157 @@ Design goals:
 - Not a full C++ parser, but:
   * tokenizes identifiers via regex
   * (optional, default on) masks comments + string/char literals to avoid noise
-- Optional multiprocessing for speed on big trees (Pool)  [see Python docs]
+- Optional multiprocessing for speed on big trees (ProcessPoolExecutor)  [see Python docs]
 """
 
 from __future__ import annotations
 
 import argparse
+import codecs
 import csv
+import hashlib
 import json
+import math
+import mmap
 import os
 import re
-from dataclasses import dataclass, asdict
+import sys
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, asdict, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Iterable
+from types import GeneratorType
+from typing import Dict, FrozenSet, List, Tuple, Optional, Iterable, Union
+
+try:
+    # Optional: C++ bit-parallel Levenshtein (pip install rapidfuzz)
+    from rapidfuzz.distance import Levenshtein as _RFL
+except ImportError:
+    _RFL = None
+
+try:
+    # Optional: JIT for the banded DP, run on whole token batches (pip install numba)
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
+try:
+    # Optional: compiled NEAR tokenizer + distance (cythonize -i search_core.pyx)
+    import search_core as _core
+except ImportError:
+    _core = None
+
+try:
+    # Optional: fast JSON encoder for --json (pip install orjson)
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+try:
+    # Optional: SIMD multi-literal scan for COMPARE (pip install hyperscan)
+    import hyperscan as _hs
+except ImportError:
+    _hs = None
+
+# Conservative ASCII identifier tokenization (common in C/C++ codebases).
+# Everything is scanned as (UTF-8) bytes: the C/C++ lexical bits we care about are ASCII.
+# A run next to a non-ASCII letter/digit is part of a longer word ("Größe")
+# and skipped as a whole, like str-mode \b did. Non-ASCII neighbours that
+# are not letters (BOM, no-break space, em-dash, ...) still separate tokens.
+# Matches without a non-ASCII neighbour come from the first alternative;
+# the rest land in group 1 and go through glued_to_word().
+IDENT_RE = re.compile(
+    rb"(?<![\x80-\xff])\b[_A-Za-z][_A-Za-z0-9]*\b(?![\x80-\xff])"
+    rb"|(\b[_A-Za-z][_A-Za-z0-9]*\b)"
+)
+IDENT_BYTES = frozenset(b"_ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+
+
+def _is_word_char(seq: bytes) -> bool:
+    # seq is exactly one UTF-8 encoded letter/digit (str-mode \w)
+    try:
+        ch = seq.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return len(ch) == 1 and ch.isalnum()
+
+
+def glued_to_word(text, start: int, end: int) -> bool:
+    """
+    True if the ASCII run text[start:end] touches a non-ASCII letter or
+    digit (decoded as UTF-8) on either side. Invalid UTF-8 is not glue.
+    """
+    if start > 0 and text[start - 1] >= 0x80:
+        k = start - 1
+        while k > 0 and k > start - 4 and 0x80 <= text[k] < 0xC0:
+            k -= 1  # back to the lead byte
+        if _is_word_char(text[k:start]):
+            return True
+    if end < len(text) and text[end] >= 0x80:
+        lead = text[end]
+        size = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+        if _is_word_char(text[end:end + size]):
+            return True
+    return False
+
 
-# Conservative ASCII identifier tokenization (common in C/C++ codebases)
-IDENT_RE = re.compile(r"\b[_A-Za-z][_A-Za-z0-9]*\b")
+# With --mmap, files at least this big are memory-mapped instead of read
+MMAP_MIN_SIZE = 64 * 1024
+
+# What load_text hands out: both support find(), slicing, re and the buffer protocol
+Buffer = Union[bytes, mmap.mmap]
 
 
 # ---------------------------
 # Masking comments/strings
 # ---------------------------
 
-def mask_cpp_comments_and_strings(src: str) -> str:
+# Same rules as mask_cpp_comments_and_strings_loop, as one alternation:
+# unterminated comments/literals run to end of input, a raw string
+# without '(' or without its closing )delim" masks the rest.
+_MASK_RE = re.compile(
+    rb'//[^\n]*'
+    rb'|/\*.*?(?:\*/|\Z)'
+    rb'|"[^"\\]*(?:\\.[^"\\]*)*(?:"|\\?\Z)'
+    rb"|'[^'\\]*(?:\\.[^'\\]*)*(?:'|\\?\Z)"
+    rb'|R"([^(]*)(?:\((?:.*?\)\1"|.*))?',
+    re.DOTALL,
+)
+
+# _MASK_RE fused with the identifier scan: masked regions are matched and
+# skipped, identifiers outside them land in group 2 (group 3 if they touch
+# non-ASCII, see IDENT_RE), so the masked copy is never built.
+# An identifier directly followed by R" ends before the R (the masker
+# blanks R"... as a raw string), hence the two variants.
+_SCAN_RE = re.compile(
+    _MASK_RE.pattern +
+    rb'|((?<![\x80-\xff])\b(?:[_A-Za-z][_A-Za-z0-9]*\b(?![\x80-\xff])(?!(?<=R)")|[_A-Za-z][_A-Za-z0-9]*?(?=R")))'
+    rb'|(\b(?:[_A-Za-z][_A-Za-z0-9]*\b(?!(?<=R)")|[_A-Za-z][_A-Za-z0-9]*?(?=R")))',
+    re.DOTALL,
+)
+
+# bytes.translate table: every byte -> b' ', except b'\n'
+_BLANK_TABLE = bytes(0x0A if c == 0x0A else 0x20 for c in range(256))
+
+
+def _blank_match(m: re.Match) -> bytes:
+    return m.group(0).translate(_BLANK_TABLE)
+
+
+def mask_cpp_comments_and_strings(src: Buffer) -> bytes:
+    """
+    Regex-driven version of mask_cpp_comments_and_strings_loop (same output).
+
+    The scan for comment/literal starts runs inside the regex engine;
+    Python code only runs once per masked region.
+    """
+    return _MASK_RE.sub(_blank_match, src)
+
+
+def mask_cpp_comments_and_strings_loop(src: Buffer) -> bytes:
     """
     Best-effort masking of:
       - // line comments
@@ -44,52 +172,52 @@ def mask_cpp_comments_and_strings(src: str) -> str:
       - 'char literals' with escapes
       - raw string literals: R"delim( ... )delim"
 
-    Returns a string of same length:
+    Returns bytes of same length:
       - masked regions replaced with spaces
       - newlines preserved (line numbers remain valid)
     """
+    SLASH, STAR, DQUOTE, SQUOTE, BSLASH, NL, RAW, LPAREN = b"/*\"'\\\nR("
+
     n = len(src)
-    out = list(src)  # we will overwrite masked chars with ' '
+    out = bytearray(src)  # we will overwrite masked bytes with b' '
     i = 0
 
     def put_spaces(a: int, b: int) -> None:
-        # replace [a,b) with spaces except keep '\n'
-        for k in range(a, b):
-            if out[k] != "\n":
-                out[k] = " "
+        # replace [a,b) with spaces except keep '\n' (one C-level pass per span)
+        out[a:b] = out[a:b].translate(_BLANK_TABLE)
 
     while i < n:
         c = src[i]
 
         # line comment //
-        if c == "/" and i + 1 < n and src[i + 1] == "/":
+        if c == SLASH and i + 1 < n and src[i + 1] == SLASH:
             j = i
             # mask until end of line
             i += 2
-            while i < n and src[i] != "\n":
+            while i < n and src[i] != NL:
                 i += 1
             put_spaces(j, i)
             continue
 
         # block comment /* ... */
-        if c == "/" and i + 1 < n and src[i + 1] == "*":
+        if c == SLASH and i + 1 < n and src[i + 1] == STAR:
             j = i
             i += 2
-            while i + 1 < n and not (src[i] == "*" and src[i + 1] == "/"):
+            while i + 1 < n and not (src[i] == STAR and src[i + 1] == SLASH):
                 i += 1
             i = min(n, i + 2)  # include closing */
             put_spaces(j, i)
             continue
 
         # normal string literal "..."
-        if c == '"':
+        if c == DQUOTE:
             j = i
             i += 1
             while i < n:
-                if src[i] == "\\" and i + 1 < n:
+                if src[i] == BSLASH and i + 1 < n:
                     i += 2
                     continue
-                if src[i] == '"':
+                if src[i] == DQUOTE:
                     i += 1
                     break
                 i += 1
@@ -97,14 +225,14 @@ def mask_cpp_comments_and_strings(src: str) -> str:
             continue
 
         # char literal '...'
-        if c == "'":
+        if c == SQUOTE:
             j = i
             i += 1
             while i < n:
-                if src[i] == "\\" and i + 1 < n:
+                if src[i] == BSLASH and i + 1 < n:
                     i += 2
                     continue
-                if src[i] == "'":
+                if src[i] == SQUOTE:
                     i += 1
                     break
                 i += 1
@@ -113,12 +241,12 @@ def mask_cpp_comments_and_strings(src: str) -> str:
 
         # raw string literal: R"delim( ... )delim"
         # minimal detection: starts with R"
-        if c == "R" and i + 1 < n and src[i + 1] == '"':
+        if c == RAW and i + 1 < n and src[i + 1] == DQUOTE:
             j = i
             i += 2  # after R"
             # delimiter up to '(' (can be empty)
             delim_start = i
-            while i < n and src[i] != "(":
+            while i < n and src[i] != LPAREN:
                 # raw delimiter cannot contain spaces, backslash, parentheses per standard,
                 # but we won't enforce; we just search '('.
                 i += 1
@@ -129,7 +257,7 @@ def mask_cpp_comments_and_strings(src: str) -> str:
             delim = src[delim_start:i]
             i += 1  # skip '('
             # find closing sequence: ')' + delim + '"'
-            close_seq = ")" + delim + '"'
+            close_seq = b")" + delim + b'"'
             close_pos = src.find(close_seq, i)
             if close_pos == -1:
                 put_spaces(j, n)
@@ -140,7 +268,7 @@ def mask_cpp_comments_and_strings(src: str) -> str:
 
         i += 1
 
-    return "".join(out)
+    return bytes(out)
 
 
 # ---------------------------
@@ -195,6 +323,147 @@ def bounded_levenshtein(a: str, b: str, k: int) -> int:
     return prev[nb] if prev[nb] <= k else big
 
 
+if njit is not None:
+    @njit(cache=True)
+    def _bounded_levenshtein_u8(a, b, k):
+        """
+        bounded_levenshtein on uint8 arrays, compiled by numba.
+        The two DP rows are preallocated and swapped instead of rebuilt.
+        """
+        na, nb = a.shape[0], b.shape[0]
+        if na > nb:
+            a, b = b, a
+            na, nb = nb, na
+        big = k + 1
+        if nb - na > k:
+            return big
+
+        prev = np.empty(nb + 1, np.int32)
+        cur = np.empty(nb + 1, np.int32)
+        for j in range(nb + 1):
+            prev[j] = j
+
+        for i in range(1, na + 1):
+            start = max(1, i - k)
+            end = min(nb, i + k)
+            cur[:] = big
+            cur[0] = i
+
+            row_min = big
+            ai = a[i - 1]
+            for j in range(start, end + 1):
+                cost = 0 if ai == b[j - 1] else 1
+                v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+                cur[j] = v
+                if v < row_min:
+                    row_min = v
+
+            if row_min > k:
+                return big
+
+            prev, cur = cur, prev
+
+        return prev[nb] if prev[nb] <= k else big
+
+    @njit(cache=True)
+    def _bounded_levenshtein_batch_u8(buf, offs, needle, k, out):
+        # token t is buf[offs[t]:offs[t+1]]; one call per file keeps
+        # the Python->JIT dispatch cost off the per-token path
+        for t in range(offs.shape[0] - 1):
+            out[t] = _bounded_levenshtein_u8(buf[offs[t]:offs[t + 1]], needle, k)
+else:
+    _bounded_levenshtein_batch_u8 = None
+
+
+def build_peq(needle: str) -> Dict[str, int]:
+    """
+    Pattern-match table for myers_bounded:
+      char -> bitmask of the positions where it occurs in needle
+
+    Build it once per needle and reuse it for every candidate token.
+    """
+    peq: Dict[str, int] = {}
+    for i, c in enumerate(needle):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def myers_bounded(text_tok: str, peq: Dict[str, int], needle_len: int, k: int) -> int:
+    """
+    Levenshtein distance between text_tok and the needle behind peq, with cutoff:
+      returns k+1 if distance > k
+
+    Myers' bit-parallel algorithm (global distance variant, Hyyroe):
+    the whole DP column is packed into Python ints, so each character
+    of text_tok costs a handful of integer ops instead of a row of DP cells.
+    """
+    m = needle_len
+    big = k + 1
+    if m == 0:
+        return len(text_tok) if len(text_tok) <= k else big
+
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp = mask
+    vn = 0
+    score = m
+    remaining = len(text_tok)
+
+    for c in text_tok:
+        x = peq.get(c, 0) | vn
+        d0 = (((x & vp) + vp) ^ vp) | x
+        hn = vp & d0
+        hp = vn | ~(vp | d0)
+
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+
+        # score can drop by at most 1 per remaining char
+        remaining -= 1
+        if score - remaining > k:
+            return big
+
+        x = (hp << 1) | 1
+        vn = x & d0
+        vp = ((hn << 1) | ~(x | d0)) & mask
+
+    return score if score <= k else big
+
+
+def near_distances(tokens: List[str], ncmp: str, peq: Dict[str, int], k: int) -> List[int]:
+    """
+    Bounded distance of each token to ncmp (k+1 = farther than k).
+
+    Picks the fastest backend installed: rapidfuzz, the numba batch DP
+    (ASCII needle), else myers_bounded with the shared peq.
+    """
+    if k < 0:
+        # nothing is within a negative distance (rapidfuzz rejects the cutoff)
+        return [k + 1] * len(tokens)
+
+    if _RFL is not None:
+        # rapidfuzz returns k+1 once the cutoff is exceeded
+        dist = _RFL.distance
+        return [dist(t, ncmp, score_cutoff=k) for t in tokens]
+
+    if _bounded_levenshtein_batch_u8 is not None and tokens and ncmp.isascii():
+        # IDENT_RE tokens are ASCII by construction
+        enc = [t.encode("ascii") for t in tokens]
+        offs = np.zeros(len(enc) + 1, np.int64)
+        np.cumsum([len(e) for e in enc], out=offs[1:])
+        out = np.empty(len(enc), np.int32)
+        _bounded_levenshtein_batch_u8(
+            np.frombuffer(b"".join(enc), np.uint8), offs,
+            np.frombuffer(ncmp.encode("ascii"), np.uint8), k, out
+        )
+        return out.tolist()
+
+    nlen = len(ncmp)
+    return [myers_bounded(t, peq, nlen, k) for t in tokens]
+
+
 # ---------------------------
 # Filesystem helpers
 # ---------------------------
@@ -248,11 +517,56 @@ class Occurrence:
     col: int
 
 
+@dataclass
+class LocStore:
+    """
+    Locations as parallel int arrays (struct-of-arrays) instead of one
+    Occurrence per hit. path_ids index the run's path table; Occurrence
+    objects are only built for printing/JSON.
+
+    cap bounds the store (0 = unlimited): once full, append/extend drop
+    further locations, so the first cap ones (in scan order) are kept.
+    """
+    path_ids: array = field(default_factory=lambda: array("i"))
+    lines: array = field(default_factory=lambda: array("i"))
+    cols: array = field(default_factory=lambda: array("i"))
+    cap: int = 0
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def room(self) -> int:
+        # how many more locations fit (-1 = unlimited)
+        return -1 if self.cap == 0 else max(self.cap - len(self.lines), 0)
+
+    def append(self, path_id: int, line: int, col: int) -> None:
+        if self.room() == 0:
+            return
+        self.path_ids.append(path_id)
+        self.lines.append(line)
+        self.cols.append(col)
+
+    def extend(self, other: LocStore) -> None:
+        room = self.room()
+        take = len(other) if room < 0 else min(len(other), room)
+        if take <= 0:
+            return
+        self.path_ids.extend(other.path_ids[:take])
+        self.lines.extend(other.lines[:take])
+        self.cols.extend(other.cols[:take])
+
+    def occurrences(self, path_table: List[str]) -> List[Occurrence]:
+        return [
+            Occurrence(path=path_table[p], line=line, col=col)
+            for p, line, col in zip(self.path_ids, self.lines, self.cols)
+        ]
+
+
 @dataclass
 class NearTokenAggregate:
     token: str
     count: int
-    locs: List[Occurrence]
+    locs: LocStore
 
 
 @dataclass
@@ -261,92 +575,641 @@ class CompareFileRow:
     count_a: int
     count_b: int
     diff: int
-    locs_a: List[Occurrence]
-    locs_b: List[Occurrence]
+    locs_a: LocStore
+    locs_b: LocStore
+
+
+def compare_row_dict(row: CompareFileRow, path_table: List[str]) -> dict:
+    # asdict() layout, with locations materialized as Occurrence dicts
+    return {
+        "path": row.path,
+        "count_a": row.count_a,
+        "count_b": row.count_b,
+        "diff": row.diff,
+        "locs_a": [asdict(o) for o in row.locs_a.occurrences(path_table)],
+        "locs_b": [asdict(o) for o in row.locs_b.occurrences(path_table)],
+    }
 
 
 # ---------------------------
-# Tokenization per line
+# Tokenization
 # ---------------------------
 
-def iter_identifiers_with_pos(text: str) -> Iterable[Tuple[str, int, int]]:
+def line_start_offsets(text: Buffer) -> List[int]:
+    """
+    Offsets at which each line starts (starts[0] is line 1).
+    Line breaks are '\n' only; a CRLF '\r' stays at the end of its line.
+    """
+    starts = [0]
+    find = text.find
+    i = find(b"\n")
+    while i != -1:
+        starts.append(i + 1)
+        i = find(b"\n", i + 1)
+    return starts
+
+
+def iter_identifiers_with_pos(text: Buffer, skip_masked: bool = False) -> Iterable[Tuple[bytes, int, int]]:
     """
     Yields (token, line_no, col_1based) for each identifier match.
+    Tokens are ASCII bytes; columns count bytes.
+
+    One regex pass over the whole buffer; (line, col) come from a
+    bisect into the line-start table instead of splitting into lines.
+    skip_masked=True on an unmasked buffer gives the same result as
+    mask_cpp_comments_and_strings() first, in that same single pass.
+    """
+    starts = line_start_offsets(text)
+    if not skip_masked:
+        for m in IDENT_RE.finditer(text):
+            p = m.start()
+            if m.lastindex and glued_to_word(text, p, m.end()):
+                continue
+            lineno = bisect_right(starts, p)
+            yield m.group(0), lineno, p - starts[lineno - 1] + 1
+        return
+
+    for m in _SCAN_RE.finditer(text):
+        g = m.lastindex
+        if g == 2 or (g == 3 and not glued_to_word(text, m.start(), m.end())):
+            p = m.start()
+            lineno = bisect_right(starts, p)
+            yield m.group(g), lineno, p - starts[lineno - 1] + 1
+
+
+# codecs.lookup() names of the encodings scanned without transcoding
+_RAW_ENCODINGS = frozenset({"ascii", "utf-8"})
+
+
+@lru_cache(maxsize=None)
+def _scanned_raw(encoding: str) -> bool:
+    # Only utf-8 (and its subset ascii) is scanned raw: glued_to_word()
+    # reads non-ASCII neighbours as UTF-8. Single-byte codecs (latin-1,
+    # cp125x) are transcoded so their letters are recognized; multibyte
+    # codecs like cp932, gbk or big5 reuse 0x5C (backslash) and letters as
+    # 2nd bytes; utf-16/32 do not keep ASCII at all.
+    return codecs.lookup(encoding).name in _RAW_ENCODINGS
+
+
+def load_text(path: Path, encoding: str, use_mmap: bool = False) -> Buffer:
+    """
+    File contents as bytes. UTF-8 (and ASCII) files are used as-is
+    (no decode); anything else is transcoded to UTF-8 once.
+
+    With use_mmap, files of MMAP_MIN_SIZE or more come back as a read-only
+    mmap: the regexes scan the page cache directly. A file truncated while
+    mapped makes the next access raise SIGBUS, which kills the process, so
+    this is opt-in (--mmap). Pass the result to release_text() when done.
     """
-    for lineno, line in enumerate(text.splitlines(), start=1):
-        for m in IDENT_RE.finditer(line):
-            yield m.group(0), lineno, m.start() + 1
+    if not _scanned_raw(encoding):
+        return path.read_bytes().decode(encoding, errors="replace").encode("utf-8")
 
+    with open(path, "rb") as f:
+        if use_mmap and os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
 
-def load_text(path: Path, encoding: str) -> str:
-    return path.read_text(encoding=encoding, errors="replace")
+
+def release_text(text: Buffer) -> None:
+    # unmap right away instead of whenever the mmap gets collected
+    if isinstance(text, mmap.mmap):
+        text.close()
+
+
+# ---------------------------
+# Whole-file prefilter
+# ---------------------------
+
+@lru_cache(maxsize=None)
+def _ci_literal_re(literals: Tuple[bytes, ...]) -> re.Pattern:
+    return re.compile(b"|".join(re.escape(t) for t in literals), re.IGNORECASE)
+
+
+def contains_any(text: Buffer, literals: Tuple[bytes, ...], case_insensitive: bool) -> bool:
+    """
+    True if any literal occurs anywhere in text as a raw substring (ASCII
+    case folding if asked). Masking only blanks bytes, so a file without
+    any of them cannot produce a hit and needs no mask/tokenize pass.
+    """
+    if case_insensitive:
+        return _ci_literal_re(literals).search(text) is not None
+    return any(text.find(t) != -1 for t in literals)
+
+
+@lru_cache(maxsize=None)
+def needle_pieces(ncmp: str, k: int) -> Tuple[bytes, ...]:
+    """
+    Splits the needle into k+1 non-empty pieces. k edits can touch at most
+    k of them, so every token within distance k contains one piece
+    unchanged (pigeonhole). Empty when the needle is too short to split
+    (or k < 0, where nothing can match anyway).
+    """
+    parts = k + 1
+    n = len(ncmp)
+    if parts < 1 or n < parts:
+        return ()
+    cuts = [n * i // parts for i in range(parts + 1)]
+    return tuple(ncmp[cuts[i]:cuts[i + 1]].encode("utf-8") for i in range(parts))
+
+
+# ---------------------------
+# Token cache (--cache-dir)
+# ---------------------------
+
+# Bump when FileTokens or the masking/tokenizing rules change
+CACHE_VERSION = 4
+
+
+@dataclass
+class FileTokens:
+    """
+    A (masked) file, tokenized and grouped by distinct token: the
+    occurrences of tokens[i] are lines/cols[offsets[i]:offsets[i+1]],
+    in file order. This is what the token cache stores per file.
+    """
+    tokens: List[bytes]
+    offsets: array
+    lines: array
+    cols: array
+
+    def count(self, i: int) -> int:
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def line_cols(self, i: int, limit: int = 0) -> Iterable[Tuple[int, int]]:
+        # first `limit` occurrences of tokens[i] (0 = all)
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        if limit != 0:
+            hi = min(hi, lo + max(limit, 0))
+        return zip(self.lines[lo:hi], self.cols[lo:hi])
+
+
+def tokenize_file(text: Buffer, skip_masked: bool = False) -> FileTokens:
+    groups: Dict[bytes, Tuple[array, array]] = {}
+    for tok, line, col in iter_identifiers_with_pos(text, skip_masked):
+        g = groups.get(tok)
+        if g is None:
+            g = groups[tok] = (array("i"), array("i"))
+        g[0].append(line)
+        g[1].append(col)
+
+    ft = FileTokens(tokens=list(groups), offsets=array("i", [0]), lines=array("i"), cols=array("i"))
+    for lines, cols in groups.values():
+        ft.lines.extend(lines)
+        ft.cols.extend(cols)
+        ft.offsets.append(len(ft.lines))
+    return ft
+
+
+def load_file_tokens(
+    path: Path, encoding: str, mask: bool, fast_mask: bool, cache_dir: Path, use_mmap: bool = False
+) -> FileTokens:
+    """
+    FileTokens for path: from its cache_dir entry if that still matches the
+    file's mtime and size, else computed and written over the entry.
+    One entry per (path, mask, encoding), so edits do not pile up files.
+    """
+    st = path.stat()
+    key = "\0".join([str(path.resolve()), str(mask), encoding])
+    entry = cache_dir / (hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest() + ".tokens")
+    stamp = {
+        "version": CACHE_VERSION, "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+        "byteorder": sys.byteorder, "itemsize": array("i").itemsize,
+    }
+
+    ft = read_cache_entry(entry, stamp)
+    if ft is not None:
+        return ft
+
+    text = load_text(path, encoding, use_mmap)
+    try:
+        if mask and not fast_mask:
+            ft = tokenize_file(mask_cpp_comments_and_strings_loop(text))
+        else:
+            ft = tokenize_file(text, skip_masked=mask)
+    finally:
+        release_text(text)
+
+    write_cache_entry(entry, stamp, ft)
+    return ft
+
+
+# Cache entry layout: one JSON header line, then the tokens joined by b"\n"
+# (identifiers never contain one), then offsets, lines, cols as raw
+# array("i") data. Plain data only: nothing in it is ever executed.
+
+def read_cache_entry(entry: Path, stamp: dict) -> Optional[FileTokens]:
+    # None if missing, unreadable or made for another version of the file
+    try:
+        with open(entry, "rb") as f:
+            header = json.loads(f.readline())
+            if header["stamp"] != stamp:
+                return None
+            blob = f.read(header["tok_bytes"])
+            tokens = blob.split(b"\n") if blob else []
+            ft = FileTokens(tokens=tokens, offsets=array("i"), lines=array("i"), cols=array("i"))
+            ft.offsets.fromfile(f, len(tokens) + 1)
+            ft.lines.fromfile(f, header["locs"])
+            ft.cols.fromfile(f, header["locs"])
+        return ft
+    except Exception:
+        return None
+
+
+def write_cache_entry(entry: Path, stamp: dict, ft: FileTokens) -> None:
+    blob = b"\n".join(ft.tokens)
+    header = {"stamp": stamp, "tok_bytes": len(blob), "locs": len(ft.lines)}
+    tmp = entry.with_name(f"{entry.stem}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode("ascii") + b"\n")
+            f.write(blob)
+            ft.offsets.tofile(f)
+            ft.lines.tofile(f)
+            ft.cols.tofile(f)
+        os.replace(tmp, entry)  # atomic: readers see the old or the new entry
+    except OSError:
+        pass  # read-only cache dir: the caller still has the fresh result
 
 
 # ---------------------------
 # NEAR mode worker
 # ---------------------------
 
+@lru_cache(maxsize=None)
+def fold_ignore_set(ignore_tokens: FrozenSet[str], case_insensitive: bool) -> FrozenSet[str]:
+    """
+    --ignore-token set in comparison form, built once per process and
+    shared by every file.
+    """
+    return frozenset(t.lower() if case_insensitive else t for t in ignore_tokens)
+
+
 def scan_file_near(
     path: Path,
-    root: Path,
     needle: str,
     max_dist: int,
     case_insensitive: bool,
     same_first_char: bool,
-    ignore_tokens: List[str],
+    ignore_tokens: Iterable[str],
     max_locs_per_token: int,
     mask: bool,
-    encoding: str
+    encoding: str,
+    peq: Optional[Dict[str, int]] = None,
+    fast_mask: bool = True,
+    path_id: int = 0,
+    cache_dir: Optional[Path] = None,
+    use_mmap: bool = False
 ) -> Dict[int, Dict[str, NearTokenAggregate]]:
     """
     Returns:
       dist -> token -> aggregate(count, locs-limited)
+
+    peq is build_peq() of the (case-folded) needle; pass it in to avoid
+    rebuilding it per file. Locations refer to the file as path_id.
+    With cache_dir, the tokenized file comes from / goes to the token cache.
     """
+    if cache_dir is not None:
+        try:
+            ft = load_file_tokens(path, encoding, mask, fast_mask, cache_dir, use_mmap)
+        except Exception:
+            return {}
+        return scan_tokens_near(
+            ft, needle, max_dist, case_insensitive, same_first_char, ignore_tokens,
+            max_locs_per_token, peq, path_id
+        )
+
     try:
-        text = load_text(path, encoding)
+        text = load_text(path, encoding, use_mmap)
     except Exception:
         return {}
 
-    if mask:
-        text = mask_cpp_comments_and_strings(text)
+    try:
+        return scan_buffer_near(
+            text, needle, max_dist, case_insensitive, same_first_char, ignore_tokens,
+            max_locs_per_token, mask, peq, fast_mask, path_id
+        )
+    finally:
+        release_text(text)
+
 
+def scan_buffer_near(
+    text: Buffer,
+    needle: str,
+    max_dist: int,
+    case_insensitive: bool,
+    same_first_char: bool,
+    ignore_tokens: Iterable[str],
+    max_locs_per_token: int,
+    mask: bool,
+    peq: Optional[Dict[str, int]],
+    fast_mask: bool,
+    path_id: int
+) -> Dict[int, Dict[str, NearTokenAggregate]]:
+    """
+    scan_file_near on an already loaded file.
+    """
     ncmp = needle.lower() if case_insensitive else needle
-    ignore_set = set(t.lower() if case_insensitive else t for t in ignore_tokens)
 
-    out: Dict[int, Dict[str, NearTokenAggregate]] = {}
+    pieces = needle_pieces(ncmp, max_dist)
+    if pieces and not contains_any(text, pieces, case_insensitive):
+        return {}
 
-    for tok, line, col in iter_identifiers_with_pos(text):
-        tcmp = tok.lower() if case_insensitive else tok
+    # The fast masker is fused into the tokenizer (pass 1) unless the
+    # compiled path, which tokenizes itself, needs a masked buffer
+    use_core = _core is not None and 1 <= len(ncmp) <= 64 and ncmp.isascii()
+    fused = mask and fast_mask and not use_core
+    if mask and not fused:
+        if fast_mask:
+            text = mask_cpp_comments_and_strings(text)
+        else:
+            text = mask_cpp_comments_and_strings_loop(text)
 
-        if tcmp in ignore_set:
-            continue
+    if peq is None:
+        peq = build_peq(ncmp)
+    ignore_set = fold_ignore_set(frozenset(ignore_tokens), case_insensitive)
+    out: Dict[int, Dict[str, NearTokenAggregate]] = {}
 
-        if same_first_char:
-            if not tcmp or not ncmp or tcmp[0] != ncmp[0]:
+    if use_core:
+        # Compiled path: tokenizes and measures in C, returns matches only
+        hits = _core.near_tokens(text, ncmp.encode("ascii"), max_dist,
+                                 case_insensitive, max_locs_per_token)
+        for tok_b, (d, count, tok_locs) in hits.items():
+            tok = tok_b.decode("ascii")
+            tcmp = tok.lower() if case_insensitive else tok
+            if tcmp in ignore_set:
+                continue
+            if same_first_char and tcmp[0] != ncmp[0]:
                 continue
+            out.setdefault(d, {})[tok] = NearTokenAggregate(
+                token=tok, count=count, locs=_loc_store(path_id, tok_locs, max_locs_per_token)
+            )
+        return out
+
+    # Pass 1: count each distinct token, keep its first locations.
+    # Identifiers repeat a lot, so the distance below runs once per
+    # distinct token instead of once per occurrence.
+    counts: Dict[bytes, int] = {}
+    locs: Dict[bytes, List[Tuple[int, int]]] = {}
+
+    for tok, line, col in iter_identifiers_with_pos(text, skip_masked=fused):
+        n = counts.get(tok, 0)
+        counts[tok] = n + 1
+        if max_locs_per_token == 0 or n < max_locs_per_token:
+            locs.setdefault(tok, []).append((line, col))
+
+    tokens = list(counts)
+    for i, tok, d in near_matches(tokens, ncmp, max_dist, case_insensitive, same_first_char, ignore_set, peq):
+        tok_b = tokens[i]
+        out.setdefault(d, {})[tok] = NearTokenAggregate(
+            token=tok, count=counts[tok_b], locs=_loc_store(path_id, locs.get(tok_b, ()), max_locs_per_token)
+        )
 
-        if abs(len(tcmp) - len(ncmp)) > max_dist:
-            continue
+    return out
 
-        d = bounded_levenshtein(tcmp, ncmp, max_dist)
-        if d <= max_dist:
-            bucket = out.setdefault(d, {})
-            agg = bucket.get(tok)
-            if agg is None:
-                agg = NearTokenAggregate(token=tok, count=0, locs=[])
-                bucket[tok] = agg
-            agg.count += 1
 
-            if max_locs_per_token == 0 or len(agg.locs) < max_locs_per_token:
-                agg.locs.append(Occurrence(path=relpath_str(path, root), line=line, col=col))
+def scan_tokens_near(
+    ft: FileTokens,
+    needle: str,
+    max_dist: int,
+    case_insensitive: bool,
+    same_first_char: bool,
+    ignore_tokens: Iterable[str],
+    max_locs_per_token: int,
+    peq: Optional[Dict[str, int]],
+    path_id: int
+) -> Dict[int, Dict[str, NearTokenAggregate]]:
+    """
+    scan_file_near on a cached FileTokens: only the distinct-token table is walked.
+    """
+    ncmp = needle.lower() if case_insensitive else needle
+    if peq is None:
+        peq = build_peq(ncmp)
+    ignore_set = fold_ignore_set(frozenset(ignore_tokens), case_insensitive)
+    out: Dict[int, Dict[str, NearTokenAggregate]] = {}
+
+    for i, tok, d in near_matches(ft.tokens, ncmp, max_dist, case_insensitive, same_first_char, ignore_set, peq):
+        out.setdefault(d, {})[tok] = NearTokenAggregate(
+            token=tok, count=ft.count(i), locs=_loc_store(path_id, ft.line_cols(i, max_locs_per_token), max_locs_per_token)
+        )
 
     return out
 
 
+def near_matches(
+    tokens: List[bytes],
+    ncmp: str,
+    max_dist: int,
+    case_insensitive: bool,
+    same_first_char: bool,
+    ignore_set: FrozenSet[str],
+    peq: Dict[str, int]
+) -> List[Tuple[int, str, int]]:
+    """
+    (index, token, dist) for every distinct token within max_dist of ncmp.
+    Only lengths within max_dist of the needle can match, so only those
+    tokens are decoded, filtered and measured.
+    """
+    by_len: Dict[int, List[int]] = {}
+    for i, tok in enumerate(tokens):
+        by_len.setdefault(len(tok), []).append(i)
+
+    nlen = len(ncmp)
+    cand: List[int] = []
+    cand_tok: List[str] = []
+    cand_cmp: List[str] = []
+
+    for length in range(max(1, nlen - max_dist), nlen + max_dist + 1):
+        for i in by_len.get(length, ()):
+            tok = tokens[i].decode("ascii")
+            tcmp = tok.lower() if case_insensitive else tok
+
+            if tcmp in ignore_set:
+                continue
+
+            if same_first_char:
+                if not tcmp or not ncmp or tcmp[0] != ncmp[0]:
+                    continue
+
+            cand.append(i)
+            cand_tok.append(tok)
+            cand_cmp.append(tcmp)
+
+    return [
+        (i, tok, d)
+        for i, tok, d in zip(cand, cand_tok, near_distances(cand_cmp, ncmp, peq, max_dist))
+        if d <= max_dist
+    ]
+
+
+def _loc_store(path_id: int, line_cols: Iterable[Tuple[int, int]], cap: int) -> LocStore:
+    st = LocStore(cap=cap)
+    for line, col in line_cols:
+        st.append(path_id, line, col)
+    return st
+
+
+# Per-worker scan settings, set once by the executor initializer so tasks
+# only carry their batch of (path_id, path)
+_CFG: dict = {}
+
+
+def _init_worker(cfg: dict) -> None:
+    global _CFG
+    _CFG = cfg
+
+
+# NEAR partial as sent from a worker: tok_table plus flat typed arrays
+# (dists, counts, loc offsets, path_ids, lines, cols). Token i's
+# locations are [offs[i], offs[i+1]) of the three location arrays.
+NearPacked = Tuple[List[str], array, array, array, array, array, array]
+
+
+def scan_batch_near(batch: List[Tuple[int, Path]]) -> NearPacked:
+    """
+    Scans a batch of files in one worker task and returns them merged and
+    packed, so one compact result per batch crosses the process boundary.
+    """
+    agg: Dict[int, Dict[str, NearTokenAggregate]] = {}
+    for path_id, path in batch:
+        part = scan_file_near(path, path_id=path_id, **_CFG)
+        merge_near_partial(agg, part)
+    return pack_near_partial(agg)
+
+
+def pack_near_partial(agg: Dict[int, Dict[str, NearTokenAggregate]]) -> NearPacked:
+    tok_table: List[str] = []
+    dists = array("i")
+    counts = array("q")
+    offs = array("i", [0])
+    locs = LocStore()
+    for d, token_map in agg.items():
+        for tok, a in token_map.items():
+            tok_table.append(tok)
+            dists.append(d)
+            counts.append(a.count)
+            locs.extend(a.locs)
+            offs.append(len(locs))
+    return tok_table, dists, counts, offs, locs.path_ids, locs.lines, locs.cols
+
+
+def merge_near_packed(
+    agg: Dict[int, Dict[str, NearTokenAggregate]],
+    packed: NearPacked,
+    max_locs_per_token: int
+) -> None:
+    """
+    merge_near_partial for a pack_near_partial result.
+    """
+    tok_table, dists, counts, offs, path_ids, lines, cols = packed
+    for i, tok in enumerate(tok_table):
+        lo, hi = offs[i], offs[i + 1]
+        locs = LocStore(path_ids=path_ids[lo:hi], lines=lines[lo:hi], cols=cols[lo:hi], cap=max_locs_per_token)
+        bucket = agg.setdefault(dists[i], {})
+        cur = bucket.get(tok)
+        if cur is None:
+            bucket[tok] = NearTokenAggregate(token=tok, count=counts[i], locs=locs)
+        else:
+            cur.count += counts[i]
+            cur.locs.extend(locs)
+
+
+def merge_near_partial(
+    agg: Dict[int, Dict[str, NearTokenAggregate]],
+    part: Dict[int, Dict[str, NearTokenAggregate]]
+) -> None:
+    """
+    Folds one scan_file_near result into agg (counts add up, locs stay capped).
+    """
+    for d, token_map in part.items():
+        bucket = agg.setdefault(d, {})
+        for tok, a in token_map.items():
+            cur = bucket.get(tok)
+            if cur is None:
+                bucket[tok] = a
+            else:
+                cur.count += a.count
+                cur.locs.extend(a.locs)
+
+
 # ---------------------------
 # COMPARE mode worker
 # ---------------------------
 
+@lru_cache(maxsize=None)
+def compare_pattern(acmp: bytes, bcmp: bytes, case_insensitive: bool) -> Optional[re.Pattern]:
+    """
+    One regex matching exactly the tokens A or B (None if neither is an identifier).
+
+    Scanning for the two literals in C skips every other identifier, instead
+    of tokenizing the whole file and comparing each token in Python.
+    A wins over B when both match the same token, like the token loop did.
+    """
+    alts = [re.escape(t) for t in (acmp, bcmp) if IDENT_RE.fullmatch(t)]
+    if not alts:
+        return None
+    alt = b"|".join(alts)
+    # group 1: touches non-ASCII, compare_hits checks glued_to_word()
+    return re.compile(
+        rb"(?<![\x80-\xff])\b(?:" + alt + rb")\b(?![\x80-\xff])|(\b(?:" + alt + rb")\b)",
+        re.IGNORECASE if case_insensitive else 0,
+    )
+
+
+@lru_cache(maxsize=None)
+def compare_hs_db(acmp: bytes, bcmp: bytes, case_insensitive: bool):
+    """
+    Hyperscan database for the literals A (id 0) and B (id 1), same
+    selection as compare_pattern; None if neither is an identifier.
+    Built once per process (databases are not shared with workers).
+    """
+    lits = [(i, t) for i, t in enumerate((acmp, bcmp)) if IDENT_RE.fullmatch(t)]
+    if acmp == bcmp:
+        lits = lits[:1]  # A wins
+    if not lits:
+        return None
+    db = _hs.Database()
+    db.compile(
+        expressions=[t for _, t in lits],
+        ids=[i for i, _ in lits],
+        elements=len(lits),
+        flags=[_hs.HS_FLAG_CASELESS if case_insensitive else 0] * len(lits),
+    )
+    return db
+
+
+def compare_hits(text: Buffer, acmp: bytes, bcmp: bytes, case_insensitive: bool) -> Iterable[Tuple[int, bool]]:
+    """
+    (offset, is_a) of every A/B token in text, in file order.
+    """
+    if _hs is not None:
+        db = compare_hs_db(acmp, bcmp, case_insensitive)
+        if db is None:
+            return ()
+        # Hyperscan has no \b: a literal hit only counts as a token if
+        # it is not glued to a word character (see IDENT_RE) on either side
+        n = len(text)
+        la, lb = len(acmp), len(bcmp)
+        hits: List[Tuple[int, bool]] = []
+
+        def on_match(hit_id: int, _from: int, to: int, _flags: int, _ctx) -> None:
+            p = to - (lb if hit_id else la)
+            if ((p == 0 or text[p - 1] not in IDENT_BYTES) and (to == n or text[to] not in IDENT_BYTES)
+                    and not glued_to_word(text, p, to)):
+                hits.append((p, hit_id == 0))
+
+        db.scan(text, match_event_handler=on_match)
+        return hits
+
+    pat = compare_pattern(acmp, bcmp, case_insensitive)
+    if pat is None:
+        return ()
+    return (
+        (m.start(), (m.group(0).lower() if case_insensitive else m.group(0)) == acmp)
+        for m in pat.finditer(text)
+        if not (m.lastindex and glued_to_word(text, m.start(), m.end()))
+    )
+
+
 def scan_file_compare(
     path: Path,
     root: Path,
@@ -355,40 +1218,122 @@ def scan_file_compare(
     case_insensitive: bool,
     locs_per_file: int,
     mask: bool,
-    encoding: str
+    encoding: str,
+    fast_mask: bool = True,
+    path_id: int = 0,
+    cache_dir: Optional[Path] = None,
+    use_mmap: bool = False
 ) -> CompareFileRow:
+    rp = relpath_str(path, root)
     try:
-        text = load_text(path, encoding)
+        if cache_dir is not None:
+            ft = load_file_tokens(path, encoding, mask, fast_mask, cache_dir, use_mmap)
+            return scan_tokens_compare(ft, rp, a, b, case_insensitive, locs_per_file, path_id)
+        text = load_text(path, encoding, use_mmap)
     except Exception:
-        return CompareFileRow(path=relpath_str(path, root), count_a=0, count_b=0, diff=0, locs_a=[], locs_b=[])
+        return CompareFileRow(path=rp, count_a=0, count_b=0, diff=0, locs_a=LocStore(), locs_b=LocStore())
 
-    if mask:
-        text = mask_cpp_comments_and_strings(text)
+    try:
+        return scan_buffer_compare(text, rp, a, b, case_insensitive, locs_per_file, mask, fast_mask, path_id)
+    finally:
+        release_text(text)
 
-    acmp = a.lower() if case_insensitive else a
-    bcmp = b.lower() if case_insensitive else b
+
+def scan_buffer_compare(
+    text: Buffer,
+    rp: str,
+    a: str,
+    b: str,
+    case_insensitive: bool,
+    locs_per_file: int,
+    mask: bool,
+    fast_mask: bool,
+    path_id: int
+) -> CompareFileRow:
+    """
+    scan_file_compare on an already loaded file (rp = its relative path).
+    """
+    acmp = a.encode("utf-8").lower() if case_insensitive else a.encode("utf-8")
+    bcmp = b.encode("utf-8").lower() if case_insensitive else b.encode("utf-8")
 
     ca = 0
     cb = 0
-    la: List[Occurrence] = []
-    lb: List[Occurrence] = []
+    la = LocStore(cap=locs_per_file)
+    lb = LocStore(cap=locs_per_file)
 
-    rp = relpath_str(path, root)
+    # nothing to count: neither name is an identifier, or neither occurs at all
+    if (compare_pattern(acmp, bcmp, case_insensitive) is None
+            or not contains_any(text, (acmp, bcmp), case_insensitive)):
+        return CompareFileRow(path=rp, count_a=0, count_b=0, diff=0, locs_a=la, locs_b=lb)
 
-    for tok, line, col in iter_identifiers_with_pos(text):
-        tcmp = tok.lower() if case_insensitive else tok
-        if tcmp == acmp:
+    if mask:
+        if fast_mask:
+            text = mask_cpp_comments_and_strings(text)
+        else:
+            text = mask_cpp_comments_and_strings_loop(text)
+
+    # (line, col) only for hits whose location is kept; lines are
+    # counted incrementally between consecutive kept hits
+    line = 1
+    last = 0
+
+    for p, is_a in compare_hits(text, acmp, bcmp, case_insensitive):
+        if is_a:
             ca += 1
-            if locs_per_file == 0 or len(la) < locs_per_file:
-                la.append(Occurrence(path=rp, line=line, col=col))
-        elif tcmp == bcmp:
+            keep = la
+        else:
             cb += 1
-            if locs_per_file == 0 or len(lb) < locs_per_file:
-                lb.append(Occurrence(path=rp, line=line, col=col))
+            keep = lb
+
+        if keep.room() != 0:
+            line += text[last:p].count(b"\n")
+            last = p
+            keep.append(path_id, line, p - text.rfind(b"\n", 0, p))
 
     return CompareFileRow(path=rp, count_a=ca, count_b=cb, diff=ca - cb, locs_a=la, locs_b=lb)
 
 
+def scan_tokens_compare(
+    ft: FileTokens,
+    rp: str,
+    a: str,
+    b: str,
+    case_insensitive: bool,
+    locs_per_file: int,
+    path_id: int
+) -> CompareFileRow:
+    """
+    scan_file_compare on a cached FileTokens.
+    """
+    acmp = a.encode("utf-8").lower() if case_insensitive else a.encode("utf-8")
+    bcmp = b.encode("utf-8").lower() if case_insensitive else b.encode("utf-8")
+
+    # with --case-insensitive several spellings can map to A (or B)
+    ia: List[int] = []
+    ib: List[int] = []
+    for i, tok in enumerate(ft.tokens):
+        tcmp = tok.lower() if case_insensitive else tok
+        if tcmp == acmp:
+            ia.append(i)
+        elif tcmp == bcmp:
+            ib.append(i)
+
+    ca = sum(ft.count(i) for i in ia)
+    cb = sum(ft.count(i) for i in ib)
+
+    def first_locs(idxs: List[int]) -> LocStore:
+        # each spelling is already in file order; merge them back
+        pairs = sorted(lc for i in idxs for lc in ft.line_cols(i, locs_per_file))
+        return _loc_store(path_id, pairs, locs_per_file)
+
+    return CompareFileRow(path=rp, count_a=ca, count_b=cb, diff=ca - cb,
+                          locs_a=first_locs(ia), locs_b=first_locs(ib))
+
+
+def scan_batch_compare(batch: List[Tuple[int, Path]]) -> List[CompareFileRow]:
+    return [scan_file_compare(path, path_id=path_id, **_CFG) for path_id, path in batch]
+
+
 # ---------------------------
 # Pretty printing helpers
 # ---------------------------
@@ -397,18 +1342,76 @@ def print_kv(title: str, value: str) -> None:
     print(f"{title:<18} {value}")
 
 
-def format_locs(locs: List[Occurrence], max_items: int = 5) -> str:
-    shown = locs[:max_items]
-    s = ", ".join(f"{o.line}:{o.col}" for o in shown)
+def format_locs(locs: LocStore, max_items: int = 5) -> str:
+    s = ", ".join(f"{line}:{col}" for line, col in zip(locs.lines[:max_items], locs.cols[:max_items]))
     if len(locs) > max_items:
         s += f", …(+{len(locs)-max_items})"
     return s
 
 
+# ---------------------------
+# JSON export
+# ---------------------------
+
+class JsonObject:
+    """
+    A JSON object given as lazy (key, value) pairs, for write_json_stream.
+    """
+    def __init__(self, pairs: Iterable[Tuple[str, object]]):
+        self.pairs = pairs
+
+
+def _json_bytes(obj: object) -> bytes:
+    if _orjson is not None:
+        return _orjson.dumps(obj)
+    # allow_nan=False: NaN/Infinity are not JSON (orjson would write null)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+def write_json_stream(f, obj: object) -> None:
+    """
+    Writes obj as compact UTF-8 JSON to the binary file f, piece by piece:
+    dicts and JsonObjects are written key by key, generators as arrays
+    item by item; anything else (lists, scalars) is encoded in one go.
+    Only one piece is ever materialized.
+    """
+    if isinstance(obj, (dict, JsonObject)):
+        f.write(b"{")
+        for i, (k, v) in enumerate(obj.items() if isinstance(obj, dict) else obj.pairs):
+            if i:
+                f.write(b",")
+            f.write(_json_bytes(k))
+            f.write(b":")
+            write_json_stream(f, v)
+        f.write(b"}")
+    elif isinstance(obj, GeneratorType):
+        f.write(b"[")
+        for i, v in enumerate(obj):
+            if i:
+                f.write(b",")
+            write_json_stream(f, v)
+        f.write(b"]")
+    else:
+        f.write(_json_bytes(obj))
+
+
+def write_json(path: str, obj: object) -> None:
+    with open(path, "wb", buffering=1 << 20) as f:
+        write_json_stream(f, obj)
+
+
 # ---------------------------
 # Main
 # ---------------------------
 
+def finite_float(s: str) -> float:
+    # nan/inf would make every check fail and cannot be written to JSON
+    v = float(s)
+    if not math.isfinite(v):
+        raise argparse.ArgumentTypeError(f"must be a finite number: {s!r}")
+    return v
+
+
 def build_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(
         description="Audit C/C++ identifier usage: near-miss search and A/B count comparison."
@@ -429,12 +1432,29 @@ def build_parser() -> argparse.ArgumentParser:
         help="Directory names to skip (supports prefix wildcard via *)",
     )
     ap.add_argument("--encoding", type=str, default="utf-8", help="File encoding used to read sources")
-    ap.add_argument("--jobs", type=int, default=1, help="Parallel processes (>=2 uses multiprocessing Pool)")
+    ap.add_argument("--jobs", type=int, default=1, help="Parallel processes (>=2 uses a ProcessPoolExecutor)")
     ap.add_argument(
         "--no-mask",
         action="store_true",
         help="Do NOT mask comments/strings (by default they are masked to reduce noise)",
     )
+    ap.add_argument(
+        "--no-fast-mask",
+        action="store_true",
+        help="Mask with the pure-Python loop instead of the regex masker (same output, slower)",
+    )
+    ap.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Memory-map large files instead of reading them (saves a copy; a file truncated "
+             "during the scan crashes the process with SIGBUS)",
+    )
+    ap.add_argument(
+        "--cache-dir",
+        type=str,
+        default="",
+        help="Cache masked+tokenized files here for faster repeat runs (e.g. .shader_audit_cache)",
+    )
     ap.add_argument(
         "--only-glob",
         nargs="*",
@@ -483,7 +1503,7 @@ def build_parser() -> argparse.ArgumentParser:
     )
     p_cmp.add_argument(
         "--ratio",
-        type=float,
+        type=finite_float,
         default=1.0,
         help="Expected A/B ratio if --expect ratio (default 1.0)",
     )
@@ -536,6 +1556,47 @@ def collect_files(args, root: Path) -> List[Path]:
     return files
 
 
+# Target bytes of source per worker task (see batch_files)
+BATCH_BYTES = 4 * 1024 * 1024
+
+
+def batch_files(files: List[Path], jobs: int) -> List[List[Tuple[int, Path]]]:
+    """
+    Splits files (in order) into runs of (path_id, path) holding up to
+    BATCH_BYTES of source each, fewer on small trees so every worker still
+    gets several tasks. Contiguous runs merged in order give exactly the
+    serial result.
+    """
+    sizes = []
+    for f in files:
+        try:
+            sizes.append(f.stat().st_size)
+        except OSError:
+            sizes.append(0)
+
+    limit = max(1, min(BATCH_BYTES, sum(sizes) // (jobs * 4)))
+    batches: List[List[Tuple[int, Path]]] = []
+    cur: List[Tuple[int, Path]] = []
+    cur_bytes = 0
+    for i, (f, size) in enumerate(zip(files, sizes)):
+        if cur and cur_bytes + size > limit:
+            batches.append(cur)
+            cur, cur_bytes = [], 0
+        cur.append((i, f))
+        cur_bytes += size
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def open_cache_dir(cache_dir: str) -> Optional[Path]:
+    if not cache_dir:
+        return None
+    p = Path(cache_dir).resolve()
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
 def check_expectation(row: CompareFileRow, expect: str, ratio: float, tolerance: int) -> bool:
     if expect == "equal":
         return abs(row.diff) <= tolerance
@@ -554,6 +1615,8 @@ def cmd_near(args) -> int:
     root = Path(args.root).resolve()
     files = collect_files(args, root)
     mask = not args.no_mask
+    fast_mask = not args.no_fast_mask
+    cache_dir = open_cache_dir(args.cache_dir)
 
     print_kv("Root:", str(root))
     print_kv("Mode:", "near")
@@ -564,55 +1627,40 @@ def cmd_near(args) -> int:
     print_kv("files:", str(len(files)))
     print("")
 
-    # Aggregate: dist -> token -> (count, locs)
+    # Aggregate: dist -> token -> (count, locs); locs point into path_table
     agg: Dict[int, Dict[str, NearTokenAggregate]] = {}
+    path_table = [relpath_str(f, root) for f in files]
+
+    # Myers pattern table, shared by all files
+    ncmp = args.needle.lower() if args.case_insensitive else args.needle
+    peq = build_peq(ncmp)
+
+    if _bounded_levenshtein_batch_u8 is not None:
+        # JIT-compile (or load numba's cache) once, before workers fork
+        near_distances([ncmp], ncmp, peq, args.max_dist)
+
+    # Everything but the file is fixed for the run
+    cfg = dict(
+        needle=args.needle, max_dist=args.max_dist,
+        case_insensitive=args.case_insensitive, same_first_char=args.same_first_char,
+        ignore_tokens=frozenset(args.ignore_token),
+        max_locs_per_token=args.max_locs_per_token,
+        mask=mask, encoding=args.encoding, peq=peq, fast_mask=fast_mask, cache_dir=cache_dir,
+        use_mmap=args.mmap,
+    )
 
     if args.jobs and args.jobs >= 2:
         # multiprocessing
-        from multiprocessing import Pool  # documented in stdlib :contentReference[oaicite:2]{index=2}
+        from concurrent.futures import ProcessPoolExecutor  # documented in stdlib :contentReference[oaicite:2]{index=2}
 
-        work = [
-            (f, root, args.needle, args.max_dist, args.case_insensitive, args.same_first_char,
-             args.ignore_token, args.max_locs_per_token, mask, args.encoding)
-            for f in files
-        ]
-
-        with Pool(processes=args.jobs) as pool:
-            for partial in pool.starmap(scan_file_near, work):
-                for d, token_map in partial.items():
-                    bucket = agg.setdefault(d, {})
-                    for tok, a in token_map.items():
-                        cur = bucket.get(tok)
-                        if cur is None:
-                            bucket[tok] = NearTokenAggregate(tok, a.count, list(a.locs))
-                        else:
-                            cur.count += a.count
-                            if args.max_locs_per_token == 0:
-                                cur.locs.extend(a.locs)
-                            else:
-                                remain = args.max_locs_per_token - len(cur.locs)
-                                if remain > 0:
-                                    cur.locs.extend(a.locs[:remain])
+        # map() yields batches in file order, so capped loc lists match the serial run
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(cfg,)) as ex:
+            for packed in ex.map(scan_batch_near, batch_files(files, args.jobs)):
+                merge_near_packed(agg, packed, args.max_locs_per_token)
     else:
-        for f in files:
-            partial = scan_file_near(
-                f, root, args.needle, args.max_dist, args.case_insensitive,
-                args.same_first_char, args.ignore_token, args.max_locs_per_token, mask, args.encoding
-            )
-            for d, token_map in partial.items():
-                bucket = agg.setdefault(d, {})
-                for tok, a in token_map.items():
-                    cur = bucket.get(tok)
-                    if cur is None:
-                        bucket[tok] = NearTokenAggregate(tok, a.count, list(a.locs))
-                    else:
-                        cur.count += a.count
-                        if args.max_locs_per_token == 0:
-                            cur.locs.extend(a.locs)
-                        else:
-                            remain = args.max_locs_per_token - len(cur.locs)
-                            if remain > 0:
-                                cur.locs.extend(a.locs[:remain])
+        for i, f in enumerate(files):
+            part = scan_file_near(f, path_id=i, **cfg)
+            merge_near_partial(agg, part)
 
     # Print buckets
     total = sum(a.count for d in agg.values() for a in d.values())
@@ -629,7 +1677,7 @@ def cmd_near(args) -> int:
 
         for tok, a in sorted(token_map.items(), key=lambda kv: (-kv[1].count, kv[0])):
             print(f"\n{tok} | count={a.count}")
-            for o in a.locs:
+            for o in a.locs.occurrences(path_table):
                 print(f"  - {o.path}:{o.line}:{o.col}")
         print("")
 
@@ -642,15 +1690,15 @@ def cmd_near(args) -> int:
             "max_dist": args.max_dist,
             "case_insensitive": args.case_insensitive,
             "masked": mask,
-            "results": {
-                str(d): {
-                    tok: {"count": a.count, "locs": [asdict(o) for o in a.locs]}
+            "results": JsonObject(
+                (str(d), JsonObject(
+                    (tok, {"count": a.count, "locs": [asdict(o) for o in a.locs.occurrences(path_table)]})
                     for tok, a in agg.get(d, {}).items()
-                }
+                ))
                 for d in range(0, args.max_dist + 1)
-            },
+            ),
         }
-        Path(args.json).write_text(json.dumps(out, indent=2, ensure_ascii=False), encoding="utf-8")
+        write_json(args.json, out)
         print(f"Wrote JSON: {args.json}")
 
     if args.csv:
@@ -673,6 +1721,8 @@ def cmd_compare(args) -> int:
     root = Path(args.root).resolve()
     files = collect_files(args, root)
     mask = not args.no_mask
+    fast_mask = not args.no_fast_mask
+    cache_dir = open_cache_dir(args.cache_dir)
 
     print_kv("Root:", str(root))
     print_kv("Mode:", "compare")
@@ -688,26 +1738,30 @@ def cmd_compare(args) -> int:
     print("")
 
     rows: List[CompareFileRow] = []
+    path_table = [relpath_str(f, root) for f in files]
+
+    cfg = dict(
+        root=root, a=args.a, b=args.b, case_insensitive=args.case_insensitive,
+        locs_per_file=args.locs_per_file, mask=mask, encoding=args.encoding, fast_mask=fast_mask,
+        cache_dir=cache_dir, use_mmap=args.mmap,
+    )
 
     if args.jobs and args.jobs >= 2:
-        from multiprocessing import Pool  # :contentReference[oaicite:3]{index=3}
-        work = [
-            (f, root, args.a, args.b, args.case_insensitive, args.locs_per_file, mask, args.encoding)
-            for f in files
-        ]
-        with Pool(processes=args.jobs) as pool:
-            rows = pool.starmap(scan_file_compare, work)
+        from concurrent.futures import ProcessPoolExecutor  # :contentReference[oaicite:3]{index=3}
+
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(cfg,)) as ex:
+            for part in ex.map(scan_batch_compare, batch_files(files, args.jobs)):
+                rows.extend(part)
     else:
-        for f in files:
-            rows.append(scan_file_compare(
-                f, root, args.a, args.b, args.case_insensitive, args.locs_per_file, mask, args.encoding
-            ))
+        for i, f in enumerate(files):
+            rows.append(scan_file_compare(f, path_id=i, **cfg))
 
     # Overall totals
     total_a = sum(r.count_a for r in rows)
     total_b = sum(r.count_b for r in rows)
 
-    overall_row = CompareFileRow(path="<TOTAL>", count_a=total_a, count_b=total_b, diff=total_a - total_b, locs_a=[], locs_b=[])
+    overall_row = CompareFileRow(path="<TOTAL>", count_a=total_a, count_b=total_b, diff=total_a - total_b,
+                                 locs_a=LocStore(), locs_b=LocStore())
     overall_ok = check_expectation(overall_row, args.expect, args.ratio, args.tolerance)
 
     print_kv("TOTAL A:", str(total_a))
@@ -757,10 +1811,10 @@ def cmd_compare(args) -> int:
             "case_insensitive": args.case_insensitive,
             "masked": mask,
             "totals": {"a": total_a, "b": total_b, "diff": total_a - total_b, "ok": overall_ok},
-            "rows": [asdict(r) for r in rows],
-            "mismatches": [asdict(r) for r in mismatches],
+            "rows": (compare_row_dict(r, path_table) for r in rows),
+            "mismatches": (compare_row_dict(r, path_table) for r in mismatches),
         }
-        Path(args.json).write_text(json.dumps(out, indent=2, ensure_ascii=False), encoding="utf-8")
+        write_json(args.json, out)
         print(f"Wrote JSON: {args.json}")
 
     if args.csv:
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+check_masking.py
+
+Equivalence check for the masking fast paths in Search.py, which must stay
+byte-for-byte equal to the reference loop masker:
+  1) mask_cpp_comments_and_strings (_MASK_RE) == mask_cpp_comments_and_strings_loop
+  2) iter_identifiers_with_pos(text, skip_masked=True) (_SCAN_RE)
+     == iter_identifiers_with_pos(mask_cpp_comments_and_strings(text))
+
+Runs on random snippets built from the tricky pieces (comment/literal
+openers and closers, raw-string delimiters, escapes, non-ASCII bytes),
+plus any files/directories given on the command line.
+Run after touching either masker or the identifier regexes:
+
+    python check_masking.py                 # random snippets only
+    python check_masking.py --cases 500000 src shaders
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+from pathlib import Path
+from typing import List
+
+from Search import (
+    iter_identifiers_with_pos,
+    mask_cpp_comments_and_strings,
+    mask_cpp_comments_and_strings_loop,
+)
+
+PIECES = [
+    b"/", b"*", b'"', b"'", b"R", b"(", b")", b"\\", b"\n", b"\r", b" ",
+    b"a", b"x", b"_", b"1", b'R"', b'R"x(', b')x"', b')"', b"//", b"/*", b"*/",
+    "é".encode("utf-8"), " ".encode("utf-8"), "—".encode("utf-8"),
+    b"\xef\xbb\xbf", b"\x80", b"\xff",
+]
+
+
+def check(text: bytes) -> List[str]:
+    errors = []
+    masked = mask_cpp_comments_and_strings(text)
+    if masked != mask_cpp_comments_and_strings_loop(text):
+        errors.append("_MASK_RE != loop masker")
+    if list(iter_identifiers_with_pos(text, skip_masked=True)) != list(iter_identifiers_with_pos(masked)):
+        errors.append("_SCAN_RE != mask + IDENT_RE")
+    return errors
+
+
+def iter_files(paths: List[str]):
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from (f for f in sorted(p.rglob("*")) if f.is_file())
+        else:
+            yield p
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Check Search.py's fast maskers against the loop masker.")
+    ap.add_argument("paths", nargs="*", help="Extra files/directories to check")
+    ap.add_argument("--cases", type=int, default=100000, help="Random snippets to check")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    failures = 0
+
+    for _ in range(args.cases):
+        text = b"".join(rnd.choice(PIECES) for _ in range(rnd.randint(0, 30)))
+        for e in check(text):
+            failures += 1
+            if failures <= 10:
+                print(f"FAIL {e}: {text!r}")
+
+    files = 0
+    for f in iter_files(args.paths):
+        files += 1
+        for e in check(f.read_bytes()):
+            failures += 1
+            print(f"FAIL {e}: {f}")
+
+    print(f"{args.cases} snippets, {files} files: " + ("OK" if failures == 0 else f"{failures} failures"))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,150 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# distutils: extra_compile_args = -O3 -march=native
+
+"""
+search_core.pyx
+
+Optional compiled hot path for Search.py (NEAR mode):
+  * identifier tokenizer over a raw byte buffer (256-entry class tables)
+  * Myers bit-parallel Levenshtein on a single uint64_t (needle <= 64 chars)
+
+Search.py imports it when available and falls back to pure Python otherwise.
+Build in place next to Search.py:
+
+    pip install cython
+    cythonize -i -3 search_core.pyx
+"""
+
+from libc.stdint cimport uint64_t
+
+cdef bint _isid[256]      # [_A-Za-z0-9]
+cdef bint _isstart[256]   # [_A-Za-z]
+cdef unsigned char _lower[256]
+
+cdef int _c
+for _c in range(256):
+    _isstart[_c] = (65 <= _c <= 90) or (97 <= _c <= 122) or _c == 95
+    _isid[_c] = _isstart[_c] or (48 <= _c <= 57)
+    _lower[_c] = _c + 32 if 65 <= _c <= 90 else _c
+
+
+cdef int _myers(const unsigned char* s, Py_ssize_t n, const uint64_t* peq,
+                int m, int k, bint fold) noexcept nogil:
+    """
+    Same algorithm as Search.myers_bounded; returns k+1 if distance > k.
+    """
+    cdef uint64_t vp, vn, x, d0, hn, hp
+    cdef uint64_t last = (<uint64_t>1) << (m - 1)
+    cdef Py_ssize_t i
+    cdef int score = m
+    cdef unsigned char c
+
+    vp = (~(<uint64_t>0)) >> (64 - m)
+    vn = 0
+    for i in range(n):
+        c = _lower[s[i]] if fold else s[i]
+        x = peq[c] | vn
+        d0 = (((x & vp) + vp) ^ vp) | x
+        hn = vp & d0
+        hp = vn | ~(vp | d0)
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        if score - (n - 1 - i) > k:
+            return k + 1
+        x = (hp << 1) | 1
+        vn = x & d0
+        vp = (hn << 1) | ~(x | d0)
+
+    return score if score <= k else k + 1
+
+
+def _is_word_char(bytes seq):
+    # seq is exactly one UTF-8 encoded letter/digit (str-mode \w)
+    try:
+        ch = seq.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return len(ch) == 1 and ch.isalnum()
+
+
+cdef bint _glued(const unsigned char* p, Py_ssize_t n, Py_ssize_t i, Py_ssize_t j):
+    """
+    Same rule as Search.glued_to_word: p[i:j] touches a non-ASCII
+    letter/digit (UTF-8), so it is part of a longer word like "Größe".
+    """
+    cdef Py_ssize_t k
+    cdef int size
+    if i > 0 and p[i - 1] >= 128:
+        k = i - 1
+        while k > 0 and k > i - 4 and 0x80 <= p[k] < 0xC0:
+            k -= 1
+        if _is_word_char(p[k:i]):
+            return True
+    if j < n and p[j] >= 128:
+        size = 2 if p[j] < 0xE0 else (3 if p[j] < 0xF0 else 4)
+        if _is_word_char(p[j:min(j + size, n)]):
+            return True
+    return False
+
+
+def near_tokens(const unsigned char[::1] buf, bytes needle, int max_dist,
+                bint case_insensitive, int max_locs_per_token):
+    """
+    Tokenize buf (ASCII identifiers, same rule as Search.IDENT_RE) and
+    compare every token against needle (already case-folded, 1..64 bytes).
+
+    Returns:
+      token(bytes) -> [dist, count, [(line, col_1based), ...]]
+      with at most max_locs_per_token locations per token (0 = unlimited)
+    """
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef int m = len(needle)
+    cdef uint64_t peq[256]
+    cdef const unsigned char* p
+    cdef const unsigned char* nd = needle
+    cdef Py_ssize_t i = 0, j, line_start = 0
+    cdef int line = 1, d
+    cdef dict out = {}
+    cdef list entry
+
+    if m < 1 or m > 64:
+        raise ValueError("needle length must be 1..64")
+
+    for j in range(256):
+        peq[j] = 0
+    for j in range(m):
+        peq[nd[j]] |= (<uint64_t>1) << j
+
+    if n == 0:
+        return out
+    p = &buf[0]
+
+    while i < n:
+        if not _isid[p[i]]:
+            if p[i] == 10:
+                line += 1
+                line_start = i + 1
+            i += 1
+            continue
+
+        # maximal [_A-Za-z0-9] run; identifiers may not start with a digit
+        j = i + 1
+        while j < n and _isid[p[j]]:
+            j += 1
+
+        if _isstart[p[i]] and (j - i) - m <= max_dist and m - (j - i) <= max_dist:
+            d = _myers(p + i, j - i, peq, m, max_dist, case_insensitive)
+            if d <= max_dist and not _glued(p, n, i, j):
+                tok = p[i:j]
+                entry = out.get(tok)
+                if entry is None:
+                    entry = [d, 0, []]
+                    out[tok] = entry
+                if max_locs_per_token == 0 or entry[1] < max_locs_per_token:
+                    (<list>entry[2]).append((line, i - line_start + 1))
+                entry[1] += 1
+        i = j
+
+    return out